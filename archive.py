@@ -0,0 +1,229 @@
+import abc
+import gzip
+import io
+import os
+import pathlib
+import sys
+import tarfile
+import time
+import typing
+import zipfile
+
+import nodes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.zst', '.zip')
+
+
+def is_archive(path: pathlib.Path) -> bool:
+    """
+    >>> is_archive(pathlib.Path('site.tar.zst'))
+    True
+    >>> is_archive(pathlib.Path('_site'))
+    False
+    """
+
+    return path.name.endswith(SUFFIXES)
+
+
+def source_date_epoch() -> int:
+    """ timestamp for all entries, to make archives reproducible """
+
+    try:
+        return int(os.environ['SOURCE_DATE_EPOCH'])
+    except (KeyError, ValueError):
+        return 0
+
+
+class Archive(metaclass=abc.ABCMeta):
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.mtime = source_date_epoch()
+        self.count = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._tmp_path = path.with_name('.' + path.name + '.tmp')
+        self._raw = self._tmp_path.open('wb')
+        self._closed = False
+
+        self._names: typing.Set[str] = set()
+        self._pending: typing.Optional[nodes.Page] = None
+
+    def add_page(self, page: nodes.Page) -> None:
+        """ add page, or replace the previous one if it has the same path
+
+        Archive can't overwrite entries like directory does, so the last page
+        is held until a page of another path comes. Pages of the same path
+        come in a row, like paginated autoindex without number in target.
+        """
+
+        if self._pending is not None and self._pending.path() != page.path():
+            self._flush()
+        self._pending = page
+
+    def add_file(self, name: str, source: pathlib.Path) -> None:
+        self._flush()
+        if self._is_new(name):
+            self._write_file(name, source)
+            self.count += 1
+
+    def _flush(self) -> None:
+        page, self._pending = self._pending, None
+        if page is not None and self._is_new(page.path().as_posix()):
+            self._write_page(page)
+            self.count += 1
+
+    def _is_new(self, name: str) -> bool:
+        if name in self._names:
+            print('warning: {} is written twice, and only the first one is '
+                  'kept in {}'.format(name, self.path.name), file=sys.stderr)
+            return False
+
+        self._names.add(name)
+        return True
+
+    @abc.abstractmethod
+    def _write_page(self, page: nodes.Page) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _write_file(self, name: str, source: pathlib.Path) -> None:
+        pass
+
+    def _close_stream(self) -> None:
+        self._raw.close()
+
+    def close(self) -> str:
+        """ finish writing and returns message for log """
+
+        self._flush()
+
+        self._closed = True
+        self._close_stream()
+        os.replace(str(self._tmp_path), str(self.path))
+
+        return '{} ({} entries, {} bytes)'.format(self.path.name,
+                                                  self.count,
+                                                  self.path.stat().st_size)
+
+    def discard(self) -> None:
+        """ remove the temporary file if the archive was not closed """
+
+        if self._closed:
+            return
+        self._closed = True
+        self._pending = None
+
+        try:
+            self._close_stream()
+        except Exception:
+            pass  # the contents are thrown away anyway
+        finally:
+            if self._tmp_path.exists():
+                self._tmp_path.unlink()
+
+
+class TarArchive(Archive):
+    def __init__(self, path: pathlib.Path) -> None:
+        if path.name.endswith('.tar.zst') and zstandard is None:
+            raise ValueError('zstandard is required for .tar.zst output')
+
+        super().__init__(path)
+
+        self._compressor: typing.Optional[typing.BinaryIO] = None
+
+        fileobj: typing.BinaryIO = self._raw
+        if path.name.endswith(('.tar.gz', '.tgz')):
+            self._compressor = gzip.GzipFile(filename='',
+                                             mode='wb',
+                                             fileobj=self._raw,
+                                             mtime=self.mtime)
+            fileobj = self._compressor
+        elif path.name.endswith('.tar.zst'):
+            self._compressor = zstandard.ZstdCompressor().stream_writer(
+                self._raw,
+                closefd=False,
+            )
+            fileobj = self._compressor  # type: ignore
+
+        self._tar = tarfile.open(fileobj=fileobj,
+                                 mode='w',
+                                 format=tarfile.PAX_FORMAT)
+
+    def _info(self, name: str, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = self.mtime
+        info.mode = 0o644
+        return info
+
+    def _write_page(self, page: nodes.Page) -> None:
+        name = page.path().as_posix()
+
+        if isinstance(page, nodes.AssetPage):
+            source = page.source_path()
+            with source.open('rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self._tar.addfile(self._info(name, size), f)
+        else:
+            buf = io.BytesIO()
+            page.render(buf)
+            size = buf.tell()
+            buf.seek(0)
+            self._tar.addfile(self._info(name, size), buf)
+
+    def _write_file(self, name: str, source: pathlib.Path) -> None:
+        with source.open('rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._tar.addfile(self._info(name, size), f)
+
+    def _close_stream(self) -> None:
+        self._tar.close()
+        if self._compressor is not None:
+            self._compressor.close()
+        super()._close_stream()
+
+
+class ZipArchive(Archive):
+    def __init__(self, path: pathlib.Path) -> None:
+        super().__init__(path)
+
+        self._zip = zipfile.ZipFile(self._raw,
+                                    mode='w',
+                                    compression=zipfile.ZIP_DEFLATED)
+
+        # zip can't have timestamps before 1980
+        self._date_time = time.gmtime(max(self.mtime, 315532800))[:6]
+
+    def _info(self, name: str) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, self._date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        return info
+
+    def _write_page(self, page: nodes.Page) -> None:
+        with self._zip.open(self._info(page.path().as_posix()), 'w') as out:
+            page.render(out)  # type: ignore
+
+    def _write_file(self, name: str, source: pathlib.Path) -> None:
+        with self._zip.open(self._info(name), 'w') as out:
+            with source.open('rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    out.write(chunk)
+
+    def _close_stream(self) -> None:
+        self._zip.close()
+        super()._close_stream()
+
+
+def open_archive(path: pathlib.Path) -> Archive:
+    if path.name.endswith('.zip'):
+        return ZipArchive(path)
+    else:
+        return TarArchive(path)
@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import pathlib
+import socket
+import sys
+import typing
+
+
+def request_build(socket_path: pathlib.Path,
+                  paths: typing.Sequence[str] = None,
+                  log: typing.TextIO = sys.stdout) -> bool:
+    """ ask the build daemon to build and print its log
+
+    Returns True if the build was succeed.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+
+        request = {'paths': [os.path.abspath(p) for p in paths or []] or None}
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        last = None
+        with sock.makefile('r', encoding='utf-8') as f:
+            for line in f:
+                if last is not None:
+                    print(last, end='', file=log)
+                last = line
+
+    return last is not None and last.strip() == 'ok'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Request build to the daemon of main.py --daemon.',
+    )
+
+    parser.add_argument('paths',
+                        metavar='PATH',
+                        nargs='*',
+                        help='Source files to build, with index pages of '
+                             'their directories. Other pages that refer to '
+                             'them are not updated. (default: everything)')
+
+    parser.add_argument(
+        '-s',
+        '--socket',
+        metavar='PATH',
+        default='./.bg-cache/daemon.sock',
+        help='The socket of daemon. (default: ./.bg-cache/daemon.sock)',
+    )
+
+    args = parser.parse_args()
+
+    try:
+        ok = request_build(pathlib.Path(args.socket), args.paths)
+    except OSError as e:
+        print('error: could not connect to daemon: {}'.format(e),
+              file=sys.stderr)
+        sys.exit(2)
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,143 @@
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import pathlib
+import threading
+import time
+import typing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+TEXT_SUFFIXES = {
+    '.atom', '.css', '.csv', '.htm', '.html', '.js', '.json', '.map', '.md',
+    '.rss', '.svg', '.txt', '.xml',
+}
+
+
+def gzip_compress(data: bytes) -> bytes:
+    """
+    >>> gzip.decompress(gzip_compress(b'hello')) == b'hello'
+    True
+
+    Output is same for same input, because mtime will not written.
+    >>> gzip_compress(b'hello') == gzip_compress(b'hello')
+    True
+    """
+
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class Compressor:
+    def __init__(self,
+                 dest: pathlib.Path,
+                 cache_dir: pathlib.Path,
+                 min_size: int = 1024,
+                 workers: int = None) -> None:
+
+        self.dest = dest
+        self.min_size = min_size
+
+        self.cache_path = cache_dir / 'compress.json'
+        try:
+            with self.cache_path.open() as f:
+                self._cache: typing.Dict[str, str] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._cache = {}
+
+        self._lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._futures: typing.List[concurrent.futures.Future] = []
+
+        self.compressed = 0
+        self.skipped = 0
+        self.original_size = 0
+        self.compressed_size = 0
+        self.spent = 0.0
+
+    def variants(self, path: pathlib.Path) \
+            -> typing.List[typing.Tuple[pathlib.Path,
+                                        typing.Callable[[bytes], bytes]]]:
+
+        result = [(path.with_name(path.name + '.gz'), gzip_compress)]
+
+        if brotli is not None:
+            result.append((path.with_name(path.name + '.br'),
+                           lambda data: brotli.compress(data)))
+
+        return result
+
+    def submit(self, path: pathlib.Path) -> None:
+        if path.suffix.lower() not in TEXT_SUFFIXES:
+            return
+
+        self._futures.append(self._pool.submit(self._compress, path))
+
+    def _compress(self, path: pathlib.Path) -> None:
+        key = path.relative_to(self.dest).as_posix()
+        variants = self.variants(path)
+
+        data = path.read_bytes()
+
+        if len(data) < self.min_size:
+            for variant, _ in variants:
+                if variant.exists():
+                    variant.unlink()
+            with self._lock:
+                self._cache.pop(key, None)
+            return
+
+        digest = hashlib.sha1(data).hexdigest()
+
+        with self._lock:
+            unchanged = self._cache.get(key) == digest
+        if unchanged and all(v.exists() for v, _ in variants):
+            with self._lock:
+                self.skipped += 1
+            return
+
+        start = time.perf_counter()
+
+        sizes = []
+        for variant, compress in variants:
+            compressed = compress(data)
+            variant.write_bytes(compressed)
+            sizes.append(len(compressed))
+
+        spent = time.perf_counter() - start
+
+        with self._lock:
+            self._cache[key] = digest
+            self.compressed += 1
+            self.original_size += len(data) * len(variants)
+            self.compressed_size += sum(sizes)
+            self.spent += spent
+
+    def close(self) -> str:
+        """ wait for all tasks and returns message for log """
+
+        for future in self._futures:
+            future.result()
+        self._pool.shutdown()
+
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.cache_path.open('w') as f:
+            json.dump(self._cache, f, sort_keys=True)
+
+        ratio = (self.compressed_size / self.original_size
+                 if self.original_size else 1.0)
+
+        return ('compressed {} files ({} unchanged, {}): '
+                '{} -> {} bytes ({:.1%}) in {:.2f}s').format(
+            self.compressed,
+            self.skipped,
+            'gzip, brotli' if brotli is not None else 'gzip',
+            self.original_size,
+            self.compressed_size,
+            ratio,
+            self.spent,
+        )
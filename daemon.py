@@ -0,0 +1,109 @@
+import datetime
+import io
+import json
+import pathlib
+import socketserver
+import sys
+import traceback
+import typing
+
+import nodes
+import plugin
+import utils
+
+
+DEFAULT_SOCKET = pathlib.Path('./.bg-cache/daemon.sock')
+
+
+class BuildHandler(socketserver.StreamRequestHandler):
+    """ handle a build request
+
+    Request is a line of JSON like `{"paths": ["src/about.md"]}` and paths
+    can be null for full build. Response is log lines of the build, and the
+    last line is `ok` or `error`.
+
+    Build with paths updates the pages of those sources and the index pages
+    of their directories. Other pages that refer to them as brothers or
+    parent are not updated until the next full build.
+    """
+
+    server: 'Daemon'
+
+    def handle(self) -> None:
+        log = io.TextIOWrapper(self.wfile,
+                               encoding='utf-8',
+                               line_buffering=True,
+                               write_through=True)
+
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            paths = request.get('paths')
+
+            print(datetime.datetime.now(), ' '.join(paths or []), file=log)
+
+            self.server.build(log, paths)
+
+            print('ok', file=log)
+        except Exception:
+            traceback.print_exc(file=log)
+            print('error', file=log)
+        finally:
+            log.detach()
+
+
+class Daemon(socketserver.UnixStreamServer):
+    def __init__(self,
+                 src: pathlib.Path,
+                 dest: pathlib.Path,
+                 socket_path: pathlib.Path = DEFAULT_SOCKET,
+                 **options: typing.Any) -> None:
+
+        self.src = src
+        self.dest = dest
+        self.options = options
+
+        self.plugins = plugin.Plugins()
+        self.cache = nodes.Cache()
+
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if socket_path.exists():
+            socket_path.unlink()
+        self.socket_path = socket_path
+
+        super().__init__(str(socket_path), BuildHandler)
+
+    def build(self,
+              log: typing.TextIO,
+              paths: typing.Sequence[str] = None) -> None:
+
+        utils.build_all(self.src,
+                        self.dest,
+                        log,
+                        paths=([pathlib.Path(p) for p in paths]
+                               if paths else None),
+                        plugins=self.plugins,
+                        cache=self.cache,
+                        **self.options)
+
+    def server_close(self) -> None:
+        super().server_close()
+
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+
+def run(src: pathlib.Path,
+        dest: pathlib.Path,
+        socket_path: pathlib.Path = DEFAULT_SOCKET,
+        **options: typing.Any) -> None:
+
+    with Daemon(src, dest, socket_path, **options) as daemon:
+        # warm up caches with a full build
+        daemon.build(sys.stdout)
+
+        print('listening on {}'.format(socket_path))
+
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
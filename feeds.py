@@ -0,0 +1,482 @@
+import datetime
+import email.utils
+import filecmp
+import heapq
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import typing
+from xml.sax.saxutils import escape, quoteattr
+
+import config
+import nodes
+
+
+SITEMAP_MAX_URLS = 50000
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+
+# tempfile makes files with 0600, but outputs should be readable like others
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+DATE_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%d',
+)
+
+
+def parse_date(value: typing.Any) -> typing.Optional[datetime.datetime]:
+    """ parse `date` of front-matter
+
+
+    YAML parses some formats into datetime, but others are left as string.
+    >>> parse_date(datetime.date(2018, 1, 2))
+    datetime.datetime(2018, 1, 2, 0, 0, tzinfo=datetime.timezone.utc)
+    >>> parse_date('2018-01-02 15:04')
+    datetime.datetime(2018, 1, 2, 15, 4, tzinfo=datetime.timezone.utc)
+
+    Returns None if couldn't parse.
+    >>> parse_date('someday') is None
+    True
+    """
+
+    if isinstance(value, datetime.datetime):
+        result = value
+    elif isinstance(value, datetime.date):
+        result = datetime.datetime(value.year, value.month, value.day)
+    elif isinstance(value, str):
+        for fmt in DATE_FORMATS:
+            try:
+                result = datetime.datetime.strptime(value.strip(), fmt)
+                break
+            except ValueError:
+                pass
+        else:
+            return None
+    else:
+        return None
+
+    if result.tzinfo is None:
+        result = result.replace(tzinfo=datetime.timezone.utc)
+
+    return result
+
+
+def absolute_url(base: typing.Optional[str], url: str) -> str:
+    """
+    >>> absolute_url('https://example.com/', '/blog/')
+    'https://example.com/blog/'
+    >>> absolute_url(None, '/blog/')
+    '/blog/'
+    """
+
+    if not base:
+        return url
+
+    return base.rstrip('/') + url
+
+
+class AtomicOutput:
+    """ temporary file that replaces target only if the content was changed """
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self._file = tempfile.NamedTemporaryFile('w',
+                                                 encoding='utf-8',
+                                                 dir=str(directory),
+                                                 prefix='.',
+                                                 delete=False)
+        self.size = 0
+
+    def write(self, text: str) -> None:
+        self.size += self._file.write(text)
+
+    def commit(self, target: pathlib.Path) -> bool:
+        """ move into `target` and returns True if it was changed """
+
+        self._file.close()
+
+        if target.exists() and filecmp.cmp(self._file.name,
+                                           str(target),
+                                           shallow=False):
+            os.unlink(self._file.name)
+            return False
+
+        os.chmod(self._file.name, 0o666 & ~UMASK)
+        os.replace(self._file.name, str(target))
+        return True
+
+
+class OutputWriter:
+    def __init__(self, dest: pathlib.Path, target: str) -> None:
+        self.target = dest / target
+        self.url = '/' + pathlib.PurePosixPath(target).as_posix().lstrip('/')
+        self.files: typing.List[pathlib.Path] = []
+
+    def add(self, page: nodes.Page) -> None:
+        pass
+
+    def close(self) -> str:
+        """ finish writing and returns message for log """
+
+        return ''
+
+
+class SitemapWriter(OutputWriter):
+    def __init__(self,
+                 dest: pathlib.Path,
+                 target: str = 'sitemap.xml',
+                 base_url: str = None) -> None:
+
+        super().__init__(dest, target)
+
+        self.base_url = base_url
+        self.count = 0
+
+        self._chunks: typing.List[AtomicOutput] = []
+        self._chunk_urls = 0
+        self._last_url: typing.Optional[str] = None
+
+    def chunk_path(self, num: int) -> pathlib.Path:
+        return self.target.with_name('{}-{}{}'.format(self.target.stem,
+                                                      num,
+                                                      self.target.suffix))
+
+    def _current_chunk(self, entry_size: int) -> AtomicOutput:
+        if self._chunks:
+            chunk = self._chunks[-1]
+            if (self._chunk_urls < SITEMAP_MAX_URLS
+                    and chunk.size + entry_size < SITEMAP_MAX_BYTES - 100):
+
+                return chunk
+
+            chunk.write('</urlset>\n')
+
+        chunk = AtomicOutput(self.target.parent)
+        chunk.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<urlset xmlns='
+                    '"http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+        self._chunks.append(chunk)
+        self._chunk_urls = 0
+
+        return chunk
+
+    def add(self, page: nodes.Page) -> None:
+        if not isinstance(page, nodes.RenderablePage):
+            return
+
+        # paginated index pages share an url and they come in a row
+        url = page.url()
+        if url == self._last_url:
+            return
+        self._last_url = url
+
+        entry = '<url><loc>{}</loc>'.format(
+            escape(absolute_url(self.base_url, url)),
+        )
+
+        date = parse_date(page.config['date'])
+        if date is not None:
+            entry += '<lastmod>{}</lastmod>'.format(date.isoformat())
+
+        entry += '</url>\n'
+
+        self._current_chunk(len(entry)).write(entry)
+        self._chunk_urls += 1
+        self.count += 1
+
+    def close(self) -> str:
+        if not self._chunks:
+            self._current_chunk(0)
+
+        self._chunks[-1].write('</urlset>\n')
+
+        if len(self._chunks) == 1:
+            changed = self._chunks[0].commit(self.target)
+            self.files.append(self.target)
+            num = 1
+        else:
+            index = AtomicOutput(self.target.parent)
+            index.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<sitemapindex xmlns='
+                        '"http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+
+            changed = False
+            for num, chunk in enumerate(self._chunks, 1):
+                path = self.chunk_path(num)
+                changed = chunk.commit(path) or changed
+                self.files.append(path)
+
+                url = str(pathlib.PurePosixPath(self.url).with_name(path.name))
+                index.write('<sitemap><loc>{}</loc></sitemap>\n'.format(
+                    escape(absolute_url(self.base_url, url)),
+                ))
+
+            index.write('</sitemapindex>\n')
+            changed = index.commit(self.target) or changed
+            self.files.append(self.target)
+
+            num += 1
+
+        stale = self.chunk_path(num)
+        while stale.exists():
+            stale.unlink()
+            changed = True
+            num += 1
+            stale = self.chunk_path(num)
+
+        return '{} ({} urls in {} files, {})'.format(
+            self.target.name,
+            self.count,
+            len(self._chunks) + (1 if len(self._chunks) > 1 else 0),
+            'updated' if changed else 'unchanged',
+        )
+
+
+class FeedEntry(typing.NamedTuple):
+    date: datetime.datetime
+    url: str
+    title: str
+    summary: typing.Optional[str]
+
+
+class FeedWriter(OutputWriter):
+    def __init__(self,
+                 dest: pathlib.Path,
+                 target: str = 'feed.atom',
+                 source: str = '*',
+                 format_: str = None,
+                 limit: typing.Optional[int] = 20,
+                 title: str = None,
+                 base_url: str = None) -> None:
+
+        super().__init__(dest, target)
+
+        self.source = source
+        self.format = format_ or ('rss' if target.endswith('.rss') else 'atom')
+        self.limit = limit if isinstance(limit, int) and limit > 0 else None
+        self.title = title or ''
+        self.base_url = base_url
+        self.count = 0
+
+        self.updated: typing.Optional[datetime.datetime] = None
+
+        self._heap: typing.List[typing.Tuple[datetime.datetime, int,
+                                             FeedEntry]] = []
+
+        # entries of unlimited feed are spooled, and only their dates and
+        # positions are kept to sort them
+        self._index: typing.List[typing.Tuple[datetime.datetime, int,
+                                              int, int]] = []
+        self._body = tempfile.SpooledTemporaryFile(max_size=1024 * 1024,
+                                                   mode='w+',
+                                                   encoding='utf-8')
+
+    def _entry_xml(self, entry: FeedEntry) -> str:
+        url = escape(absolute_url(self.base_url, entry.url))
+        title = escape(entry.title)
+
+        if self.format == 'rss':
+            xml = ('<item><title>{}</title><link>{}</link>'
+                   '<guid>{}</guid><pubDate>{}</pubDate>').format(
+                title,
+                url,
+                url,
+                email.utils.format_datetime(entry.date),
+            )
+            if entry.summary:
+                xml += '<description>{}</description>'.format(
+                    escape(entry.summary),
+                )
+            return xml + '</item>\n'
+
+        xml = ('<entry><title>{}</title><link href={} /><id>{}</id>'
+               '<updated>{}</updated>').format(
+            title,
+            quoteattr(absolute_url(self.base_url, entry.url)),
+            url,
+            entry.date.isoformat(),
+        )
+        if entry.summary:
+            xml += '<summary>{}</summary>'.format(escape(entry.summary))
+        return xml + '</entry>\n'
+
+    def add(self, page: nodes.Page) -> None:
+        if not isinstance(page, nodes.RenderablePage):
+            return
+
+        # anchor to the root, like the globs of autoindex are anchored to
+        # their directory
+        path = pathlib.PurePosixPath('/' / page.path())
+        if not path.match('/' + self.source.lstrip('/')):
+            return
+
+        date = parse_date(page.config['date'])
+        if date is None:
+            return
+
+        summary = page.config['summary'] or page.config['description']
+        entry = FeedEntry(date,
+                          page.url(),
+                          str(page.config['title'] or page.url()),
+                          str(summary) if summary else None)
+
+        if self.updated is None or self.updated < date:
+            self.updated = date
+
+        self.count += 1
+
+        if self.limit is None:
+            xml = self._entry_xml(entry)
+            self._index.append((date,
+                                -self.count,
+                                self._body.tell(),
+                                len(xml)))
+            self._body.write(xml)
+        elif len(self._heap) < self.limit:
+            heapq.heappush(self._heap, (date, -self.count, entry))
+        else:
+            heapq.heappushpop(self._heap, (date, -self.count, entry))
+
+    def close(self) -> str:
+        updated = (self.updated or datetime.datetime(
+            1970, 1, 1, tzinfo=datetime.timezone.utc,
+        ))
+        url = absolute_url(self.base_url, '/')
+        self_url = absolute_url(self.base_url, self.url)
+
+        out = AtomicOutput(self.target.parent)
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+
+        if self.format == 'rss':
+            out.write('<rss version="2.0"><channel><title>{}</title>'
+                      '<link>{}</link><description>{}</description>'
+                      '<lastBuildDate>{}</lastBuildDate>\n'.format(
+                          escape(self.title),
+                          escape(url),
+                          escape(self.title),
+                          email.utils.format_datetime(updated),
+                      ))
+        else:
+            out.write('<feed xmlns="http://www.w3.org/2005/Atom">'
+                      '<title>{}</title><link href={} /><id>{}</id>'
+                      '<updated>{}</updated>\n'.format(
+                          escape(self.title),
+                          quoteattr(url),
+                          escape(self_url),
+                          updated.isoformat(),
+                      ))
+
+        # newest first
+        if self.limit is None:
+            for _, _, offset, length in sorted(self._index, reverse=True):
+                self._body.seek(offset)
+                out.write(self._body.read(length))
+        else:
+            for _, _, entry in sorted(self._heap, reverse=True):
+                out.write(self._entry_xml(entry))
+        self._body.close()
+
+        out.write('</channel></rss>\n' if self.format == 'rss' else '</feed>\n')
+
+        changed = out.commit(self.target)
+        self.files.append(self.target)
+
+        return '{} ({} entries, {})'.format(
+            self.target.name,
+            min(self.count, self.limit) if self.limit else self.count,
+            'updated' if changed else 'unchanged',
+        )
+
+
+class AssetManifestWriter(OutputWriter):
+    """ JSON that maps original urls of fingerprinted assets to real urls """
+
+    def __init__(self,
+                 dest: pathlib.Path,
+                 target: str = 'asset-manifest.json') -> None:
+
+        super().__init__(dest, target)
+
+        self.assets: typing.Dict[str, str] = {}
+
+    def add(self, page: nodes.Page) -> None:
+        if isinstance(page, nodes.AssetPage) and page.is_fingerprinted():
+            original = '/' + page.original_path().as_posix()
+            self.assets[original] = page.url()
+
+    def close(self) -> str:
+        if not self.assets:
+            # the manifest of a previous build is no longer true
+            if self.target.exists():
+                self.target.unlink()
+                return '{} (removed)'.format(self.target.name)
+            return ''
+
+        out = AtomicOutput(self.target.parent)
+        out.write(json.dumps(self.assets, indent=1, sort_keys=True) + '\n')
+
+        changed = out.commit(self.target)
+        self.files.append(self.target)
+
+        return '{} ({} assets, {})'.format(
+            self.target.name,
+            len(self.assets),
+            'updated' if changed else 'unchanged',
+        )
+
+
+def writers(conf: config.Config,
+            dest: pathlib.Path) -> typing.List[OutputWriter]:
+    """ make writers from `sitemap`, `feeds` and `asset_manifest` of the
+    root config """
+
+    site = conf['site'] if isinstance(conf['site'], dict) else {}
+    base_url = site.get('url')
+
+    if not base_url and (conf['sitemap'] or conf['feeds']):
+        print('warning: site.url is not set, so sitemap and feeds will '
+              'have relative urls that are not valid', file=sys.stderr)
+
+    result: typing.List[OutputWriter] = []
+
+    sitemap = conf['sitemap']
+    if sitemap:
+        if isinstance(sitemap, str):
+            sitemap = {'target': sitemap}
+        if not isinstance(sitemap, dict):
+            sitemap = {}
+
+        result.append(SitemapWriter(dest,
+                                    sitemap.get('target', 'sitemap.xml'),
+                                    base_url))
+
+    feeds = conf['feeds']
+    if isinstance(feeds, (str, dict)):
+        feeds = [feeds]
+
+    for feed in feeds or []:
+        if isinstance(feed, str):
+            feed = {'target': feed}
+
+        result.append(FeedWriter(dest,
+                                 feed.get('target', 'feed.atom'),
+                                 feed.get('source', '*'),
+                                 feed.get('format'),
+                                 feed.get('limit', 20),
+                                 feed.get('title', site.get('title')),
+                                 base_url))
+
+    result.append(AssetManifestWriter(
+        dest,
+        conf['asset_manifest'] or 'asset-manifest.json',
+    ))
+
+    return result
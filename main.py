@@ -1,6 +1,9 @@
 import argparse
 import pathlib
 
+import archive
+import daemon
+import shard
 import utils
 import watch
 
@@ -18,7 +21,9 @@ if __name__ == '__main__':
                         '--output',
                         metavar='DIRECTORY',
                         default='./_site',
-                        help='The directory for output. (default: ./_site)')
+                        help='The directory for output, or an archive file '
+                             'like site.tar, site.tar.gz, site.tar.zst or '
+                             'site.zip. (default: ./_site)')
 
     parser.add_argument(
         '-w',
@@ -27,12 +32,121 @@ if __name__ == '__main__':
         help='Enable watching source directory and auto rebuild.',
     )
 
+    parser.add_argument(
+        '--watch-backend',
+        choices=('auto', 'inotify', 'poll'),
+        default='auto',
+        help='How to detect changes in watch mode. (default: auto)',
+    )
+
+    parser.add_argument(
+        '--watch-interval',
+        metavar='SECONDS',
+        type=float,
+        default=1.0,
+        help='Interval of polling in watch mode. (default: 1.0)',
+    )
+
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keep running and build on requests from client.py.',
+    )
+
+    parser.add_argument(
+        '--socket',
+        metavar='PATH',
+        default=str(daemon.DEFAULT_SOCKET),
+        help='The socket for --daemon. (default: {})'.format(
+            daemon.DEFAULT_SOCKET,
+        ),
+    )
+
+    parser.add_argument(
+        '-z',
+        '--compress',
+        action='store_true',
+        help='Write .gz (and .br if brotli is installed) files beside outputs.',
+    )
+
+    parser.add_argument(
+        '--compress-min-size',
+        metavar='BYTES',
+        type=int,
+        default=1024,
+        help='Minimum size of outputs to compress. (default: 1024)',
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        metavar='DIRECTORY',
+        default='./.bg-cache',
+        help='The directory for build caches. (default: ./.bg-cache)',
+    )
+
+    parser.add_argument(
+        '--persist-fragments',
+        action='store_true',
+        help='Keep the cache of {% cache %} blocks in the cache directory.',
+    )
+
+    parser.add_argument(
+        '--shard',
+        metavar='I/N',
+        help='Build only the I-th of N parts of the site.',
+    )
+
+    parser.add_argument(
+        '--shard-by',
+        choices=('path', 'subtree'),
+        default='path',
+        help='How to split pages into shards. (default: path)',
+    )
+
+    parser.add_argument(
+        '--merge',
+        metavar='SHARD_DIRECTORY',
+        nargs='+',
+        help='Merge outputs of shard builds into the output directory.',
+    )
+
     args = parser.parse_args()
 
     src = pathlib.Path(args.source)
     dest = pathlib.Path(args.output)
 
-    if args.watch:
-        watch.run(src, dest)
+    options = {
+        'precompress': args.compress,
+        'compress_min_size': args.compress_min_size,
+        'cache_dir': pathlib.Path(args.cache_dir),
+        'persist_fragments': args.persist_fragments,
+    }
+
+    if args.shard is not None:
+        try:
+            options['shard'] = shard.Shard.parse(args.shard, args.shard_by)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if archive.is_archive(dest) and (args.compress or args.shard):
+        parser.error('--compress and --shard can not be used with archive '
+                     'output')
+
+    if dest.name.endswith('.tar.zst') and archive.zstandard is None:
+        parser.error('zstandard module is required for .tar.zst output')
+
+    if args.merge:
+        try:
+            shard.merge([pathlib.Path(d) for d in args.merge], dest)
+        except (ValueError, FileNotFoundError) as e:
+            parser.error(str(e))
+    elif args.daemon:
+        daemon.run(src, dest, pathlib.Path(args.socket), **options)
+    elif args.watch:
+        watch.run(src,
+                  dest,
+                  args.watch_backend,
+                  args.watch_interval,
+                  **options)
     else:
-        utils.build_all(src, dest)
+        utils.build_all(src, dest, **options)
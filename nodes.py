@@ -1,6 +1,9 @@
 import abc
+import hashlib
 import jinja2
+import json
 import math
+import os
 import pathlib
 import shutil
 import typing
@@ -57,6 +60,127 @@ def read_renderable_file(file_: typing.IO) -> typing.Tuple[config.Config, str]:
     return config.Config(''.join(headers)), ''.join(contents)
 
 
+def mtime_of(path: pathlib.Path) -> typing.Optional[int]:
+    try:
+        return os.stat(str(path)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# filters with context are not evaluated while compiling templates
+pass_context = getattr(jinja2, 'pass_context', None) or jinja2.contextfilter
+
+
+@pass_context
+def asset_url_filter(context: jinja2.runtime.Context, path: str) -> str:
+    """ `asset_url` for filter, that resolved on each rendering """
+
+    return context.environment.globals['asset_url'](path)
+
+
+class Cache:
+    """ configs and templates of directories that reusable between builds
+
+    Entries are invalidated when mtime of `.bg.yml`, `.template` or the
+    source file was changed, or parent entry was re-created.
+
+    Parsed source files are kept only if `keep_files` is true, because they
+    grow with the site. Use it for caches that live across builds.
+    """
+
+    def __init__(self, keep_files: bool = True) -> None:
+        self.keep_files = keep_files
+
+        self._configs: typing.Dict[pathlib.Path, typing.Tuple] = {}
+        self._templates: typing.Dict[pathlib.Path, typing.Tuple] = {}
+        self._files: typing.Dict[pathlib.Path, typing.Tuple] = {}
+
+        self._fingerprints: typing.Dict[str, typing.Tuple] = {}
+        self._fingerprints_changed = False
+
+    def fingerprint(self, source: pathlib.Path) -> str:
+        """ hash of file contents, that re-calculated only if changed """
+
+        stat = os.stat(str(source))
+        key = [stat.st_mtime_ns, stat.st_size]
+        cached = self._fingerprints.get(str(source))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        hash_ = hashlib.sha1()
+        with source.open('rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hash_.update(chunk)
+
+        digest = hash_.hexdigest()[:10]
+        self._fingerprints[str(source)] = (key, digest)
+        self._fingerprints_changed = True
+        return digest
+
+    def load_fingerprints(self, path: pathlib.Path) -> None:
+        try:
+            with path.open() as f:
+                for source, (key, digest) in json.load(f).items():
+                    self._fingerprints.setdefault(source, (key, digest))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def save_fingerprints(self, path: pathlib.Path) -> None:
+        if not self._fingerprints_changed:
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w') as f:
+            json.dump(self._fingerprints, f, sort_keys=True)
+
+        self._fingerprints_changed = False
+
+    def renderable_file(self, source: pathlib.Path) \
+            -> typing.Tuple[config.Config, str]:
+
+        if not self.keep_files:
+            with source.open() as f:
+                return read_renderable_file(f)
+
+        stat = os.stat(str(source))
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._files.get(source)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        with source.open() as f:
+            result = read_renderable_file(f)
+        self._files[source] = (key, result)
+        return result
+
+    def config(self,
+               source: pathlib.Path,
+               parent: config.Config = None) -> config.Config:
+
+        key = (mtime_of(source / '.bg.yml'), parent)
+        cached = self._configs.get(source)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        conf = config.Config.from_path(source, parent)
+        self._configs[source] = (key, conf)
+        return conf
+
+    def template(self,
+                 source: pathlib.Path,
+                 parent: template.TemplateManager = None) \
+            -> template.TemplateManager:
+
+        key = (mtime_of(source / '.template'), parent)
+        cached = self._templates.get(source)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        manager = template.TemplateManager(source, parent)
+        self._templates[source] = (key, manager)
+        return manager
+
+
 class FileTreeNode:
     def __init__(self, parent: 'Directory' = None) -> None:
         self.parent = parent
@@ -66,7 +190,8 @@ class Directory(FileTreeNode, typing.Iterable[FileTreeNode]):
     def __init__(self,
                  source: pathlib.Path,
                  parent: 'Directory' = None,
-                 plugins: plugin.Plugins = None) -> None:
+                 plugins: plugin.Plugins = None,
+                 cache: Cache = None) -> None:
 
         super().__init__(parent)
 
@@ -76,16 +201,26 @@ class Directory(FileTreeNode, typing.Iterable[FileTreeNode]):
         else:
             self.plugins = plugins
 
-        self.template: template.TemplateManager = template.TemplateManager(
+        if cache is not None:
+            self.cache = cache
+        elif parent is not None:
+            self.cache = parent.cache
+        else:
+            self.cache = Cache(keep_files=False)
+
+        self.template: template.TemplateManager = self.cache.template(
             self.source,
             parent.template if parent is not None else None,
         )
 
-        self.config: config.Config = config.Config.from_path(
+        self.config: config.Config = self.cache.config(
             source,
             parent.config if parent is not None else None,
         )
 
+        self.template.globals['asset_url'] = self.asset_url
+        self.template.filters['asset_url'] = asset_url_filter
+
     def __str__(self) -> str:
         root = self.root_path()
 
@@ -102,6 +237,46 @@ class Directory(FileTreeNode, typing.Iterable[FileTreeNode]):
         else:
             return self.source
 
+    def root(self) -> 'Directory':
+        if self.parent is not None:
+            return self.parent.root()
+        else:
+            return self
+
+    def asset_url(self, path: str) -> str:
+        """ get url of the file in source directory
+
+        Path that starts with `/` is from the root of site, and others are
+        relative from this directory. Returns `path` as is if not found.
+        """
+
+        url = self._asset_url(path)
+
+        # tell {% cache %} blocks being rendered what they depend on
+        for assets in self.template.used_assets:
+            assets[path] = url
+
+        return url
+
+    def _asset_url(self, path: str) -> str:
+        if path.startswith('/'):
+            source = self.root_path() / path.lstrip('/')
+        else:
+            source = self.source / path
+        source = pathlib.Path(os.path.normpath(str(source)))
+
+        root = self.root()
+        try:
+            if not source.is_file():
+                return path
+            page = root.get_child(source)
+        except ValueError:
+            return path
+
+        if isinstance(page, Page):
+            return page.url()
+        return path
+
     def get_converter(self, suffix) -> plugin.ConverterType:
         return self.plugins.get_converter(suffix)
 
@@ -161,7 +336,7 @@ class Directory(FileTreeNode, typing.Iterable[FileTreeNode]):
     def __iter__(self) -> typing.Iterator[FileTreeNode]:
         yield from self.auto_index_pages()
 
-        for p in self.source.iterdir():
+        for p in sorted(self.source.iterdir()):
             if p.name.startswith('.'):
                 continue
 
@@ -206,7 +381,7 @@ class Directory(FileTreeNode, typing.Iterable[FileTreeNode]):
                     return True
             return path.name.startswith('.')
 
-        for path in self.source.glob(pattern):
+        for path in sorted(self.source.glob(pattern)):
             if not is_hidden(path) and path.stem != 'index':
                 yield self.get_child(path)
 
@@ -242,6 +417,9 @@ class Page(FileTreeNode, metaclass=abc.ABCMeta):
     def url(self) -> str:
         return ('/' / self.path()).as_posix()
 
+    def source_path(self) -> pathlib.Path:
+        return self.parent.source
+
     @abc.abstractmethod
     def render(self, out: typing.BinaryIO) -> None:
         pass
@@ -287,11 +465,32 @@ class AssetPage(Page):
         super().__init__(parent)
 
         self._source = source
-        self._path = source.relative_to(parent.root_path())
+        self._original_path = source.relative_to(parent.root_path())
+        self._path: typing.Optional[pathlib.Path] = None
+
+    def is_fingerprinted(self) -> bool:
+        return bool(self.parent.config['fingerprint'])
+
+    def original_path(self) -> pathlib.Path:
+        return self._original_path
 
     def path(self) -> pathlib.Path:
+        if self._path is None:
+            if self.is_fingerprinted():
+                digest = self.parent.cache.fingerprint(self._source)
+                self._path = self._original_path.with_name('{}.{}{}'.format(
+                    self._original_path.stem,
+                    digest,
+                    self._original_path.suffix,
+                ))
+            else:
+                self._path = self._original_path
+
         return self._path
 
+    def source_path(self) -> pathlib.Path:
+        return self._source
+
     def render(self, out: typing.BinaryIO) -> None:
         shutil.copyfileobj(self._source.open('rb'), out)
 
@@ -356,10 +555,13 @@ class ArticlePage(RenderablePage):
         basepath = source.relative_to(parent.root_path()).parent
         path = basepath / (source.stem + '.html')
 
-        super().__init__(path, parent, *read_renderable_file(source.open()))
+        super().__init__(path, parent, *parent.cache.renderable_file(source))
 
         self.source = source
 
+    def source_path(self) -> pathlib.Path:
+        return self.source
+
     def suffix(self) -> typing.Optional[str]:
         return self.source.suffix
 
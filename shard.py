@@ -0,0 +1,200 @@
+import hashlib
+import json
+import pathlib
+import shutil
+import sys
+import typing
+import zlib
+
+
+MANIFEST_NAME = '.bg-manifest.json'
+
+
+class Shard(typing.NamedTuple):
+    """ one part of a build that split into `count` parts
+
+    >>> s = Shard.parse('2/3')
+    >>> s
+    Shard(index=2, count=3, by='path')
+
+    Pages are assigned by hash of their path, so all shards agree.
+    >>> [Shard(i, 3).contains(pathlib.Path('blog/index.html'))
+    ...  for i in (1, 2, 3)].count(True)
+    1
+
+    Or by the top level directory, to keep a subtree together.
+    >>> a = Shard(1, 3, 'subtree')
+    >>> a.contains(pathlib.Path('blog/a.html')) == \\
+    ...     a.contains(pathlib.Path('blog/2018/b.html'))
+    True
+    """
+
+    index: int
+    count: int
+    by: str = 'path'
+
+    @classmethod
+    def parse(cls, text: str, by: str = 'path') -> 'Shard':
+        """
+        >>> Shard.parse('4/3')
+        Traceback (most recent call last):
+            ...
+        ValueError: invalid shard: '4/3' (expected I/N and 1 <= I <= N)
+        """
+
+        try:
+            index, count = (int(x) for x in text.split('/'))
+        except ValueError:
+            index, count = 0, 0
+
+        if not 1 <= index <= count:
+            raise ValueError(
+                'invalid shard: {!r} (expected I/N and 1 <= I <= N)'.format(
+                    text,
+                ))
+
+        if by not in ('path', 'subtree'):
+            raise ValueError('invalid shard partitioning: {!r}'.format(by))
+
+        return cls(index, count, by)
+
+    def __str__(self) -> str:
+        return '{}/{}'.format(self.index, self.count)
+
+    def key(self, path: pathlib.PurePath) -> str:
+        if self.by == 'subtree' and len(path.parts) > 1:
+            return path.parts[0]
+        return path.as_posix()
+
+    def contains(self, path: pathlib.PurePath) -> bool:
+        digest = zlib.crc32(self.key(path).encode('utf-8'))
+        return digest % self.count == self.index - 1
+
+    def manifest_name(self) -> str:
+        return '.bg-manifest-{}of{}.json'.format(self.index, self.count)
+
+
+class HashingWriter:
+    """ writer that calculates hash and size of written data """
+
+    def __init__(self, out: typing.BinaryIO) -> None:
+        self.out = out
+        self.hash = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        self.size += len(data)
+        return self.out.write(data)
+
+
+class Manifest:
+    def __init__(self, shard: str = None, by: str = None) -> None:
+        self.shard = shard
+        self.by = by
+        self.files: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> 'Manifest':
+        with path.open() as f:
+            data = json.load(f)
+
+        self = cls(data.get('shard'), data.get('by'))
+        self.files = data['files']
+        return self
+
+    def add(self, path: pathlib.PurePath, sha1: str, size: int) -> None:
+        self.files[path.as_posix()] = {'sha1': sha1, 'size': size}
+
+    def add_file(self, dest: pathlib.Path, path: pathlib.Path) -> None:
+        hash_ = hashlib.sha1()
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hash_.update(chunk)
+
+        self.add(path.relative_to(dest),
+                 hash_.hexdigest(),
+                 path.stat().st_size)
+
+    def save(self, path: pathlib.Path) -> None:
+        with path.open('w') as f:
+            data = {'shard': self.shard, 'by': self.by, 'files': self.files}
+            json.dump(data, f, indent=1, sort_keys=True)
+
+
+def remove_stale_manifests(dest: pathlib.Path, shard: Shard) -> None:
+    """ remove manifests of builds that split into other number of shards
+
+    Manifests of the other shards in the same split are kept, so all shards
+    can be built into the same directory.
+    """
+
+    keep = '.bg-manifest-*of{}.json'.format(shard.count)
+
+    for path in dest.glob('.bg-manifest-*of*.json'):
+        if not path.match(keep):
+            path.unlink()
+
+
+def merge(shard_dirs: typing.Iterable[pathlib.Path],
+          dest: pathlib.Path,
+          log: typing.TextIO = sys.stdout) -> None:
+    """ combine outputs of shards into `dest` by their manifests """
+
+    result = Manifest()
+    seen: typing.Set[Shard] = set()
+    manifests: typing.List[typing.Tuple[pathlib.Path, Manifest]] = []
+
+    # validate all manifests before writing anything into dest
+    for shard_dir in shard_dirs:
+        paths = sorted(shard_dir.glob('.bg-manifest-*.json'))
+        if not paths:
+            raise FileNotFoundError(
+                'manifest was not found in {}'.format(shard_dir))
+
+        for path in paths:
+            manifest = Manifest.load(path)
+            seen.add(Shard.parse(manifest.shard, manifest.by or 'path'))
+            manifests.append((shard_dir, manifest))
+
+            for name, info in manifest.files.items():
+                known = result.files.get(name)
+                if known is not None and known['sha1'] != info['sha1']:
+                    raise ValueError(
+                        'conflict: {} differs between shards'.format(name))
+
+                result.files[name] = info
+
+    counts = {s.count for s in seen}
+    bys = {s.by for s in seen}
+    if (len(counts) != 1 or len(bys) != 1
+            or len(seen) != next(iter(counts))):
+
+        raise ValueError('shards are missing or mixed: {}'.format(
+            ', '.join(sorted('{} by {}'.format(s, s.by) for s in seen)),
+        ))
+
+    for shard_dir, manifest in manifests:
+        for name in sorted(manifest.files):
+            src = shard_dir / name
+            out = dest / name
+
+            if src.resolve() == out.resolve():
+                continue
+
+            print('{} -> {} (shard {})'.format(src, out, manifest.shard),
+                  file=log)
+
+            out.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(str(src), str(out))
+
+            for suffix in ('.gz', '.br'):
+                variant = src.with_name(src.name + suffix)
+                if variant.exists():
+                    shutil.copyfile(str(variant),
+                                    str(out.with_name(out.name + suffix)))
+
+    dest.mkdir(parents=True, exist_ok=True)
+    result.save(dest / MANIFEST_NAME)
+
+    print('merged {} files'.format(len(result.files)), file=log)
@@ -1,7 +1,237 @@
+import collections
+import hashlib
+import json
+import os
 import pathlib
 import typing
 
 import jinja2
+import jinja2.ext
+import jinja2.nodes
+
+
+class FragmentCache:
+    """ LRU cache for rendered fragments of templates
+
+    >>> cache = FragmentCache(max_entries=2)
+    >>> cache.set('a', 'x')
+    >>> cache.set('b', 'y')
+    >>> cache.get('a')
+    'x'
+    >>> cache.set('c', 'z')
+    >>> cache.get('b') is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+
+    def __init__(self,
+                 max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024) -> None:
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries: typing.MutableMapping[str, str] = \
+            collections.OrderedDict()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self,
+            key: str,
+            is_valid: typing.Callable[[str], bool] = None) \
+            -> typing.Optional[str]:
+        """ get the value, or None if not found or `is_valid` rejected it
+
+        >>> cache = FragmentCache()
+        >>> cache.set('a', 'x')
+        >>> cache.get('a', lambda value: value == 'y') is None
+        True
+        >>> cache.misses
+        1
+        """
+
+        value = self._entries.get(key)
+        if value is None or (is_valid is not None and not is_valid(value)):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)  # type: ignore
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+
+        if len(value) > self.max_bytes:
+            return
+
+        self._entries[key] = value
+        self._size += len(value)
+
+        while (len(self._entries) > self.max_entries
+               or self._size > self.max_bytes):
+
+            _, old = self._entries.popitem(last=False)  # type: ignore
+            self._size -= len(old)
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+
+        return ('fragment cache: {} hits, {} misses ({:.1%}), '
+                '{} entries').format(
+            self.hits,
+            self.misses,
+            self.hits / total if total else 0.0,
+            len(self._entries),
+        )
+
+    def load(self, path: pathlib.Path) -> None:
+        try:
+            with path.open() as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        for key, value in entries:
+            self.set(key, value)
+
+    def save(self, path: pathlib.Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w') as f:
+            json.dump(list(self._entries.items()), f)
+
+
+class FragmentCacheExtension(jinja2.ext.Extension):
+    """ `{% cache key, ... %}...{% endcache %}` tag
+
+    Rendered body is reused while the keys and the template are same.
+    Cache is `fragment_cache` attribute of the environment.
+
+    Templates that included or imported inside the block by constant names
+    are also checked by their mtime and size. Templates that imported
+    outside the block, included by variable names, or referenced from
+    those templates are not tracked, so put them into the keys if needed.
+
+    Results of `asset_url` inside the block are recorded with the body, and
+    the body is re-rendered if one of them was changed.
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser: jinja2.parser.Parser) -> jinja2.nodes.Node:
+        lineno = next(parser.stream).lineno
+
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        template_hash = hashlib.sha1()
+        if parser.filename is not None:
+            template_hash.update(pathlib.Path(parser.filename).read_bytes())
+        template_hash.update('{}:{}'.format(parser.name, lineno).encode())
+
+        ref_types = (jinja2.nodes.Include,
+                     jinja2.nodes.Import,
+                     jinja2.nodes.FromImport)
+
+        depends: typing.List[str] = []
+        for node in body:
+            refs = list(node.find_all(ref_types))
+            if isinstance(node, ref_types):
+                refs.append(node)
+
+            for ref in refs:
+                if isinstance(ref.template, jinja2.nodes.Const):
+                    depends.append(ref.template.value)
+
+        return jinja2.nodes.CallBlock(
+            self.call_method('_render_cached', [
+                jinja2.nodes.Const(template_hash.hexdigest()),
+                jinja2.nodes.Const(tuple(sorted(set(depends)))),
+                jinja2.nodes.List(keys),
+            ]),
+            [],
+            [],
+            body,
+        ).set_lineno(lineno)
+
+    def _depends_state(self, names: typing.Sequence[str]) -> str:
+        state = []
+
+        for name in names:
+            try:
+                filename = self.environment.get_template(name).filename
+                stat = os.stat(filename)  # type: ignore
+            except (jinja2.TemplateNotFound, TypeError, OSError):
+                state.append((name, None, None))
+            else:
+                state.append((name, stat.st_mtime_ns, stat.st_size))
+
+        return repr(state)
+
+    def _render_cached(self,
+                       template_hash: str,
+                       depends: typing.Sequence[str],
+                       keys: typing.List[typing.Any],
+                       caller: typing.Callable[[], str]) -> str:
+
+        cache = getattr(self.environment, 'fragment_cache', None)
+        if cache is None:
+            return caller()
+
+        key = hashlib.sha1(
+            (template_hash + self._depends_state(depends) + repr(keys))
+            .encode('utf-8'),
+        ).hexdigest()
+
+        # value is JSON of asset urls that used in the body, and the body
+        value = cache.get(key, self._assets_unchanged)
+        if value is not None:
+            return value.partition('\n')[2]
+
+        used_assets = getattr(self.environment, 'used_assets', None)
+        if used_assets is None:
+            used_assets = []
+
+        assets: typing.Dict[str, str] = {}
+        used_assets.append(assets)
+        try:
+            body = caller()
+        finally:
+            used_assets.pop()
+
+        cache.set(key, json.dumps(assets, sort_keys=True) + '\n' + body)
+
+        return body
+
+    def _assets_unchanged(self, value: str) -> bool:
+        try:
+            assets = json.loads(value.partition('\n')[0])
+        except ValueError:
+            return False
+
+        if not assets:
+            return True
+
+        asset_url = self.environment.globals.get('asset_url')
+        if asset_url is None:
+            return False
+
+        # calling asset_url also records them into outer blocks
+        return all(asset_url(path) == url for path, url in assets.items())
 
 
 class Resolver(jinja2.BaseLoader):
@@ -41,12 +271,24 @@ class TemplateManager(jinja2.Environment):
                  source_dir: pathlib.Path,
                  parent: jinja2.Environment = None) -> None:
 
-        super().__init__(loader=Resolver(
-            source_dir,
-            parent.loader if parent is not None else None,
-        ))
+        super().__init__(
+            loader=Resolver(
+                source_dir,
+                parent.loader if parent is not None else None,
+            ),
+            extensions=[FragmentCacheExtension],
+        )
         self.source_dir = source_dir
 
+        # urls that asset_url returned while rendering each {% cache %} block
+        self.used_assets: typing.List[typing.Dict[str, str]] = []
+
+        self.fragment_cache: FragmentCache = (
+            parent.fragment_cache  # type: ignore
+            if parent is not None
+            else FragmentCache()
+        )
+
     def __str__(self) -> str:
         return '<template.TemplateManager {}>'.format(self.source_dir)
 
@@ -1,18 +1,124 @@
 import pathlib
 import sys
+import tempfile
 import typing
 
+import archive
+import compress
+import feeds
 import nodes
+import plugin
+import shard as shard_
+
+
+def is_selected(page: nodes.Page,
+                paths: typing.Optional[typing.Sequence[pathlib.Path]]) -> bool:
+    """ check the source of page is one of `paths` or under them
+
+    Index pages of directories that contain `paths` are also selected,
+    because they list or embed the pages under them. Other pages that refer
+    to the selected pages as brothers or parent are not updated.
+    """
+
+    if paths is None:
+        return True
+
+    source = page.source_path().resolve()
+    for path in paths:
+        if source == path or path in source.parents:
+            return True
+
+    if isinstance(page, nodes.IndexPageMixIn):
+        directory = page.parent.source.resolve()
+        for path in paths:
+            if path == directory or directory in path.parents:
+                return True
+
+    return False
 
 
 def build_all(src: pathlib.Path,
               dest: pathlib.Path,
-              log: typing.TextIO = sys.stdout) -> None:
+              log: typing.TextIO = sys.stdout,
+              precompress: bool = False,
+              compress_min_size: int = 1024,
+              cache_dir: pathlib.Path = pathlib.Path('./.bg-cache'),
+              shard: shard_.Shard = None,
+              paths: typing.Sequence[pathlib.Path] = None,
+              plugins: plugin.Plugins = None,
+              cache: nodes.Cache = None,
+              persist_fragments: bool = False) -> None:
+
+    if archive.is_archive(dest):
+        if precompress or shard is not None or paths is not None:
+            raise ValueError('archive output can not be used with '
+                             'compression, shards or partial builds')
+
+    # each shard has own caches, so resolve it before loading anything
+    manifest = None
+    if shard is not None:
+        manifest = shard_.Manifest(str(shard), shard.by)
+        cache_dir = cache_dir / 'shard-{}of{}'.format(shard.index, shard.count)
+
+    dir_ = nodes.Directory(src, plugins=plugins, cache=cache)
+
+    fragments = dir_.template.fragment_cache
+    fragments.reset_stats()
+    if persist_fragments:
+        fragments.load(cache_dir / 'fragments.json')
+
+    if paths is not None:
+        paths = [p.resolve() for p in paths]
+
+    dir_.cache.load_fingerprints(cache_dir / 'fingerprints.json')
+
+    # pages are written into the archive directly, and only sitemap and
+    # feeds are made in a temporary directory
+    archive_out = None
+    outputs_tmp = None
+    outputs_dest = dest
+    if archive.is_archive(dest):
+        outputs_tmp = tempfile.TemporaryDirectory()
+        outputs_dest = pathlib.Path(outputs_tmp.name)
+        archive_out = archive.open_archive(dest)
+
+    try:
+        # sitemap and feeds need every page, but only need to be written once
+        outputs: typing.List[feeds.OutputWriter] = []
+        if shard is None or shard.index == 1:
+            outputs = feeds.writers(dir_.config, outputs_dest)
+
+        compressor = None
+        if precompress:
+            compressor = compress.Compressor(dest,
+                                             cache_dir,
+                                             compress_min_size)
 
-    dir_ = nodes.Directory(src)
+        written: typing.Dict[pathlib.Path, None] = {}
+
+        for page in dir_.walk():
+            if not isinstance(page, nodes.Page):
+                continue
+
+            for output in outputs:
+                output.add(page)
+
+            if shard is not None and not shard.contains(page.path()):
+                continue
+
+            if not is_selected(page, paths):
+                continue
+
+            if archive_out is not None:
+                print('{} -> {}:{} ({})'.format(page.path(),
+                                                dest,
+                                                page.path().as_posix(),
+                                                page.url()),
+                      file=log)
+
+                archive_out.add_page(page)
+                continue
 
-    for page in dir_.walk():
-        if isinstance(page, nodes.Page):
             out_path = dest / page.path()
 
             print('{} -> {} ({})'.format(page.path(), out_path, page.url()),
@@ -20,4 +126,59 @@ def build_all(src: pathlib.Path,
 
             out_path.parent.mkdir(parents=True, exist_ok=True)
             with out_path.open('wb') as fp:
-                page.render(fp)
+                if manifest is None:
+                    page.render(fp)
+                else:
+                    writer = shard_.HashingWriter(fp)
+                    page.render(writer)  # type: ignore
+                    manifest.add(page.path(),
+                                 writer.hash.hexdigest(),
+                                 writer.size)
+
+            written[out_path] = None
+
+        # compress after the walk, because a path can be written more than
+        # once
+        if compressor is not None:
+            for path in written:
+                compressor.submit(path)
+
+        for output in outputs:
+            message = output.close()
+            if message:
+                print(message, file=log)
+
+            for path in output.files:
+                if archive_out is not None:
+                    archive_out.add_file(
+                        path.relative_to(outputs_dest).as_posix(),
+                        path,
+                    )
+                if compressor is not None:
+                    compressor.submit(path)
+                if manifest is not None:
+                    manifest.add_file(dest, path)
+
+        if compressor is not None:
+            print(compressor.close(), file=log)
+
+        if archive_out is not None:
+            print(archive_out.close(), file=log)
+    finally:
+        if archive_out is not None:
+            archive_out.discard()
+        if outputs_tmp is not None:
+            outputs_tmp.cleanup()
+
+    dir_.cache.save_fingerprints(cache_dir / 'fingerprints.json')
+
+    if fragments.hits or fragments.misses:
+        print(fragments.stats(), file=log)
+
+    if persist_fragments:
+        fragments.save(cache_dir / 'fragments.json')
+
+    if manifest is not None and shard is not None:
+        dest.mkdir(parents=True, exist_ok=True)
+        manifest.save(dest / shard.manifest_name())
+        shard_.remove_stale_manifests(dest, shard)
@@ -1,49 +1,370 @@
+import abc
+import asyncio
+import concurrent.futures
+import ctypes
+import ctypes.util
 import datetime
+import os
 import pathlib
+import struct
 import sys
+import time
+import typing
 
+import nodes
+import plugin
 import utils
 
 
-try:
-    import pyinotify
+Callback = typing.Callable[[typing.List[pathlib.Path]], None]
 
+Snapshot = typing.Dict[str, typing.Tuple[int, int, int]]
 
-    class Watcher(pyinotify.ProcessEvent):
-        def __init__(self, src: pathlib.Path, dest: pathlib.Path) -> None:
-            self.src = src
-            self.dest = dest
 
-            self.wm = pyinotify.WatchManager()
-            self.notifier = pyinotify.Notifier(self.wm, self)
-            self.wdd = self.wm.add_watch(str(src.resolve()), pyinotify.IN_CREATE | pyinotify.IN_MODIFY | pyinotify.IN_MOVED_FROM, rec=True)
+def is_hidden(name: str) -> bool:
+    return name.startswith('.') and name not in ('.bg.yml', '.template')
 
-        def loop(self) -> None:
-            self.notifier.loop()
 
-        def process_default(self, event) -> None:
-            if (event is not None
-                and event.name.startswith('.')
-                and event.name != '.bg.yml'):
+def is_ignored(path: pathlib.Path, root: pathlib.Path) -> bool:
+    """ check if the path is not a part of site
 
-                return
+    >>> root = pathlib.Path('src')
+    >>> is_ignored(pathlib.Path('src/.bg.yml'), root)
+    False
+    >>> is_ignored(pathlib.Path('src/blog/.template/index.html'), root)
+    False
+    >>> is_ignored(pathlib.Path('src/.about.md.swp'), root)
+    True
+    >>> is_ignored(pathlib.Path('src/.git/index'), root)
+    True
+    """
 
-            print(datetime.datetime.now(),
-                  event.pathname if event is not None else '')
+    try:
+        parts = path.relative_to(root).parts
+    except ValueError:
+        return True
 
+    return any(is_hidden(part) for part in parts)
+
+
+class Watcher(metaclass=abc.ABCMeta):
+    def __init__(self,
+                 root: pathlib.Path,
+                 excludes: typing.Iterable[pathlib.Path] = ()) -> None:
+
+        self.root = root.resolve()
+        self.excludes = {str(p.resolve()) for p in excludes}
+
+    def is_watched_dir(self, path: str) -> bool:
+        return (not is_hidden(os.path.basename(path))
+                and path not in self.excludes)
+
+    @abc.abstractmethod
+    def run(self, callback: Callback) -> None:
+        """ call `callback` with changed paths each time something changed """
+
+
+class InotifyWatcher(Watcher):
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self,
+                 root: pathlib.Path,
+                 excludes: typing.Iterable[pathlib.Path] = (),
+                 delay: float = 0.1) -> None:
+
+        super().__init__(root, excludes)
+
+        self.delay = delay
+
+        name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not supported on this platform')
+
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self._watches: typing.Dict[int, pathlib.Path] = {}
+        self._changes: typing.Set[pathlib.Path] = set()
+
+        self.add_tree(self.root)
+
+    def add_watch(self, path: pathlib.Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd,
+                                          os.fsencode(str(path)),
+                                          self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            print('warning: could not watch {}: {}'.format(
+                path, os.strerror(errno),
+            ), file=sys.stderr)
+            return
+
+        self._watches[wd] = path
+
+    def add_tree(self, path: pathlib.Path) -> None:
+        """ watch `path` and all directories under it """
+
+        stack = [str(path)]
+        while stack:
+            current = stack.pop()
+            self.add_watch(pathlib.Path(current))
+
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if (entry.is_dir(follow_symlinks=False)
+                                and self.is_watched_dir(entry.path)):
+
+                            stack.append(entry.path)
+            except OSError:
+                pass
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                self._changes.add(self.root)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+
+            if mask & self.IN_IGNORED:
+                del self._watches[wd]
+                continue
+
+            path = directory / os.fsdecode(name) if name else directory
+
+            # watch new directories when they appeared
+            if (mask & self.IN_ISDIR
+                    and mask & (self.IN_CREATE | self.IN_MOVED_TO)
+                    and self.is_watched_dir(str(path))):
+
+                self.add_tree(path)
+
+            if not is_ignored(path, self.root):
+                self._changes.add(path)
+
+    async def _loop(self, callback: Callback) -> None:
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def on_readable() -> None:
+            self._read()
+            if self._changes:
+                event.set()
+
+        loop.add_reader(self._fd, on_readable)
+
+        try:
+            while True:
+                await event.wait()
+
+                # wait until the burst of events was finished
+                while True:
+                    event.clear()
+                    await asyncio.sleep(self.delay)
+                    if not event.is_set():
+                        break
+
+                changes = sorted(self._changes)
+                self._changes.clear()
+                event.clear()
+
+                callback(changes)
+        finally:
+            loop.remove_reader(self._fd)
+
+    def run(self, callback: Callback) -> None:
+        try:
+            asyncio.run(self._loop(callback))
+        finally:
+            os.close(self._fd)
+
+
+class PollingWatcher(Watcher):
+    def __init__(self,
+                 root: pathlib.Path,
+                 excludes: typing.Iterable[pathlib.Path] = (),
+                 interval: float = 1.0,
+                 workers: int = None) -> None:
+
+        super().__init__(root, excludes)
+
+        self.interval = interval
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+        # take the baseline now, so changes during the first build are seen
+        self._previous = self.snapshot()
+
+    def scan_tree(self, path: str) -> Snapshot:
+        result: Snapshot = {}
+
+        stack = [path]
+        while stack:
+            current = stack.pop()
             try:
-                utils.build_all(self.src, self.dest)
-            except Exception as e:
-                print(e, file=sys.stderr)
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+
+                        result[entry.path] = (entry.inode(),
+                                              st.st_mtime_ns,
+                                              st.st_size)
+
+                        if (entry.is_dir(follow_symlinks=False)
+                                and self.is_watched_dir(entry.path)):
+
+                            stack.append(entry.path)
+            except OSError:
+                pass
+
+        return result
+
+    def snapshot(self) -> Snapshot:
+        """ stat all files, scanning each top level directory in a thread """
+
+        result: Snapshot = {}
+        subtrees = []
+
+        try:
+            with os.scandir(str(self.root)) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+                    result[entry.path] = (entry.inode(),
+                                          st.st_mtime_ns,
+                                          st.st_size)
+
+                    if (entry.is_dir(follow_symlinks=False)
+                            and self.is_watched_dir(entry.path)):
+
+                        subtrees.append(entry.path)
+        except OSError:
+            pass
+
+        for part in self._pool.map(self.scan_tree, subtrees):
+            result.update(part)
+
+        return result
+
+    @staticmethod
+    def diff(old: Snapshot, new: Snapshot) -> typing.List[pathlib.Path]:
+        """
+        >>> PollingWatcher.diff({'a': (1, 0, 0), 'b': (2, 0, 0)},
+        ...                     {'b': (2, 1, 0), 'c': (3, 0, 0)})
+        [PosixPath('a'), PosixPath('b'), PosixPath('c')]
+        """
+
+        changed = old.keys() ^ new.keys()
+        changed.update(p for p in old.keys() & new.keys() if old[p] != new[p])
+
+        return [pathlib.Path(p) for p in sorted(changed)]
+
+    def run(self, callback: Callback) -> None:
+        previous = self._previous
+
+        try:
+            while True:
+                time.sleep(self.interval)
+
+                current = self.snapshot()
+                changes = [p for p in self.diff(previous, current)
+                           if not is_ignored(p, self.root)]
+                previous = self._previous = current
+
+                if changes:
+                    callback(changes)
+        finally:
+            self._pool.shutdown()
+
+
+def make_watcher(src: pathlib.Path,
+                 excludes: typing.Iterable[pathlib.Path] = (),
+                 backend: str = 'auto',
+                 interval: float = 1.0) -> Watcher:
+
+    if backend in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(src, excludes)
+        except (OSError, AttributeError, TypeError) as e:
+            if backend == 'inotify':
+                raise
+
+            print('warning: inotify is not available, use polling: {}'.format(
+                e,
+            ), file=sys.stderr)
+
+    return PollingWatcher(src, excludes, interval)
+
+
+def run(src: pathlib.Path,
+        dest: pathlib.Path,
+        backend: str = 'auto',
+        interval: float = 1.0,
+        **options: typing.Any) -> None:
+
+    plugins = plugin.Plugins()
+    cache = nodes.Cache()
+
+    def build(changes: typing.List[pathlib.Path]) -> None:
+        print(datetime.datetime.now(), ' '.join(str(p) for p in changes))
+
+        try:
+            utils.build_all(src,
+                            dest,
+                            plugins=plugins,
+                            cache=cache,
+                            **options)
+        except Exception as e:
+            print(e, file=sys.stderr)
 
-            print()
+        print()
 
+    excludes = [dest, options.get('cache_dir', pathlib.Path('./.bg-cache'))]
+    watcher = make_watcher(src, excludes, backend, interval)
 
-    def run(src: pathlib.Path, dest: pathlib.Path) -> None:
-        watcher = Watcher(src, dest)
-        watcher.process_default(None)
-        watcher.loop()
+    build([])
 
-except ImportError:
-    def run(src: pathlib.Path, dest: pathlib.Path) -> None:
-        print('error: pyinotify is not installed.', file=sys.stderr)
+    try:
+        watcher.run(build)
+    except KeyboardInterrupt:
+        pass